@@ -17,13 +17,91 @@ This program requires the "yaml" package to be installed.
 from __future__ import print_function
 
 import argparse
+import functools
+import json
 import os
 import os.path
 import re
 import sys
+import tempfile
 
 import yaml
 
+# Use the libyaml parser if it is available, it is much faster.
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Patterns used for every author
+_WS_RE = re.compile(r"\s+")
+_DOT_RE = re.compile(r"\.(\w)")
+_INIT_SPLIT_RE = re.compile(r"[ -\.\~]")
+
+
+@functools.lru_cache(maxsize=None)
+def format_initials(initials):
+    """Format initials from the author db for use in TeX."""
+    # Preference for A.~B.~Surname rather than A.B.~Surname
+    initials = _DOT_RE.sub(r".~\1", initials)
+    # For spaces in initials use a ~
+    return _WS_RE.sub("~", initials)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_address(address):
+    """Split an affiliation into institute, city, state, postcode and
+    country for \\paperauthor. Missing parts are empty strings."""
+    addr = [a.strip() for a in address.split(",")]
+    tute = addr[0]
+    city = state = pcode = country = ""
+    ind = len(addr) - 1
+    if ind > 0:
+        country = addr[ind]
+        ind = ind - 1
+    if ind > 0:
+        sc = addr[ind].split()
+        ind = ind - 1
+        state = sc[0]
+        if len(sc) == 2:
+            pcode = sc[1]
+    if ind > 0:
+        city = addr[ind]
+    return tute, city, state, pcode, country
+
+
+@functools.lru_cache(maxsize=None)
+def get_initials(initials):
+    """Authors db has full name not initials -
+    sometimes we just want intials"""
+    names = _INIT_SPLIT_RE.split(initials)
+    return "~" + ".~".join(name[0] for name in names if name) + "."
+
+
+# Default (AAS) formatters. Other modes replace these with the bound
+# format() method of their own template string.
+def aas_affil(cmd, ind, text):
+    """Format of the affiliation."""
+    return rf"\{cmd}[{ind}]{{{text}}}"
+
+
+def aas_auth_afil(affils, sep, ind):
+    """Format of author with affiliation."""
+    return affils + sep + ind
+
+
+def aas_author(orcid, initials, surname):
+    """Format of the author."""
+    return rf"\author{orcid}{{~{initials}~{surname}}}"
+
+
+def full_affil_text(address):
+    """Affiliation text as given in the author db."""
+    return address
+
+
+def institute_affil_text(address):
+    """Only the institute part of the affiliation."""
+    return parse_address(address)[0]
+
+
 # Set to True to write a comma separated list of authors
 WRITE_CSV = False
 
@@ -35,253 +113,377 @@ WRITE_CSV = False
 # the current working directory.
 authorfile = os.path.join("authors.yaml")
 
-# this should probably be a dict with the value of affil_cmd
-# the keys could then be passed to the arg parser.
-OUTPUT_MODES = ["aas", "spie", "adass", "arxiv"]
-
-description = __doc__
-formatter = argparse.RawDescriptionHelpFormatter
-parser = argparse.ArgumentParser(description=description, formatter_class=formatter)
-
-parser.add_argument(
-    "-m",
-    "--mode",
-    default="aas",
-    choices=OUTPUT_MODES,
-    help="""Display mode for translated parameters.
-                         'verbose' displays all the information...""",
-)
-parser.add_argument(
-    "-n", "--noafil", action="store_true", help="""Do not add affil at all for arxiv."""
-)
-args = parser.parse_args()
-
-buffer_affil = False  # hold affiliation until after author output
-buffer_authors = False  # out put authors in one \author command (adass)
-affil_cmd = "affiliation"  # command for latex affiliation
-affil_form = r"\{}[{}]{{{}}}"  # format of the affiliation
-auth_afil_form = "{}{}{}"  # format of author with affiliation
-author_form = r"\author{}{{~{}~{}}}"  # fomrmat of the author
-author_super = False  # Author affiliation as super script
-author_sep = " and "
-
-# The default is AAS and if no mode is specified you get that
-if args.mode == "arxiv":
-    author_form = r"{} {}{}"
-    affil_cmd = ""
-    affil_out_sep = ", "
-    affil_form = r"{}({}) {}"
-    auth_afil_form = "{}{}({})"
-    buffer_affil = True
-    buffer_authors = True
-    author_sep = ", "
-
-if args.mode == "spie":
-    affil_cmd = "affil"
-    buffer_affil = True
-
-if args.mode == "adass":
-    affil_cmd = "affil"
-    affil_out_sep = "\n"
-    affil_form = r"\{}{{$^{}${}}}"
-    auth_afil_form = "{}{}$^{}$"
-    author_form = r"{}~{}{}"  # initial, surname, affil
-    buffer_affil = True
-    buffer_authors = True
-    author_super = True
-
-with open(authorfile, "r") as fh:
-    authors = yaml.safe_load(fh)
-
 # This is the database file with all the generic information
 # about authors. Locate it relative to this script.
 exedir = os.path.abspath(os.path.dirname(__file__))
 dbfile = os.path.normpath(os.path.join(exedir, os.path.pardir, "etc", "authordb.yaml"))
 
-with open(dbfile, "r") as fh:
-    authordb = yaml.safe_load(fh)
-
-# author db is dict indexed by author id.
-# Each entry is a dict with keys
-# name: Surname
-# initials: A.B.
-# orcid: ORCID (can be None)
-# affil: List of affiliation labels
-# altaffil: List of alternate affiliation text
-authorinfo = authordb["authors"]
-
-# dict of all the affiliations, key is a label
-# used in author list
-affil = authordb["affiliations"]
-affilset = list()  # it will be a set but I want index() which is supported in list
-
-# AASTeX6.1 author files are of the form:
-# \author[ORCID]{Initials~Surname}
-# \altaffiliation{Hubble Fellow}   * must come straight after author
-# \affiliation{Affil1}
-# \affiliation{Affill2}
-# Do not yet handle \email or \correspondingauthor
-
-if WRITE_CSV:
-    # Used for arXiv submission
-    names = ["{auth[initials]} {auth[name]}".format(auth=a) for a in authors]
-    print(", ".join(names))
-    sys.exit(0)
-
-print(
-    """%% DO NOT EDIT THIS FILE. IT IS GENERATED FROM db2authors.py"
-%% Regenerate using:"""
-)
-print(f"%%    python $LSST_TEXMF_DIR/bin/db2authors.py {args} ")
-print()
-
-authOutput = list()
-allAffil = list()
-pAuthorOutput = list()
-indexOutput = list()
-
-anum = 0
 
+def load_authordb(dbfile):
+    """Read the author database, using a JSON cache of the parsed YAML.
 
-def get_initials(initials):
-    """Authors db has full name not initials -
-    sometimes we just want intials"""
-    names = re.split(r"[ -\.\~]", initials)
-    realInitials = []
-    for name in names:
-        if len(name) > 0:
-            realInitials.append(name[0])
-    return "~" + ".~".join(realInitials) + "."
-
+    The cache sits next to the YAML file and records the modification
+    time and size of the file it was made from. If either differs the
+    YAML is parsed again and the cache rewritten. Data that JSON can not
+    hold exactly (dates, non-string keys) is not cached, and failure to
+    write the cache (e.g. a read-only install) is not an error.
+    """
+    cachefile = dbfile + ".cache.json"
+    st = os.stat(dbfile)
+    try:
+        with open(cachefile, "r") as fh:
+            cache = json.load(fh)
+        if cache["mtime"] == st.st_mtime_ns and cache["size"] == st.st_size:
+            return cache["data"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
 
-for anum, authorid in enumerate(authors):
-    orcid = ""
+    with open(dbfile, "rb") as fh:
+        authordb = yaml.load(fh, Loader=Loader)
 
+    cache = {"mtime": st.st_mtime_ns, "size": st.st_size, "data": authordb}
     try:
-        auth = authorinfo[authorid]
-    except KeyError as e:
-        raise RuntimeError(
-            f"Author ID {authorid} not defined in author database."
-        ) from e
-
-    affilOutput = list()
-    affilAuth = ""
-    affilSep = ""
-    if author_super and anum < len(authors) - 1:
-        # ADASS  comma before the affil except the last entry
-        affilSep = ","
-    for theAffil in auth["affil"]:
-        if theAffil not in affilset:
-            affilset.append(theAffil)
-            # unforuneately you can not output an affil before an author
-            affilOutput.append(
-                affil_form.format(affil_cmd, len(affilset), affil[theAffil])
-            )
+        text = json.dumps(cache)
+        # Only cache what reads back unchanged
+        if json.loads(text)["data"] != authordb:
+            return authordb
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(cachefile), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fh:
+                fh.write(text)
+            # mkstemp files are private, the cache should not be
+            os.chmod(tmpname, 0o644)
+            os.replace(tmpname, cachefile)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+    except (OSError, TypeError, ValueError):
+        pass
+    return authordb
+
+
+# Each output mode has an emit function called for every author and
+# an optional post function called once all authors have been seen.
+# emit gets the mode settings, and both get buf, the dict of output lists:
+#   out: lines written to stdout
+#   authors: formatted author for each author, for buffered modes
+#   affils: formatted affiliations, for buffered modes
+#   paperauthors, index: \paperauthor and \aindex line for each author
+# emit also gets a dict describing the author:
+#   anum: position of the author in authors.yaml
+#   auth: the author db entry
+#   initials, surname: formatted for TeX
+#   affils: full text of the author's affiliations
+#   affilAuth: affiliation indices to attach to the author
+#   affilOutput: formatted affiliations first used by this author
+# Authors are either written straight to out (aas, spie) or buffered
+# to be written as one block by post (adass, arxiv).
+
+
+def emit_aas(mode, buf, author):
+    """Author followed by its alternate and full affiliations."""
+    auth = author["auth"]
+    out = buf["out"]
+    orcid = ""
+    if auth.get("orcid"):
+        orcid = f"[{auth['orcid']}]"
+    out.append(mode["author_form"](orcid, author["initials"], author["surname"]))
+    if auth.get("altaffil"):
+        for af in auth["altaffil"]:
+            out.append(rf"\altaffiliation{{{af}}}")
+
+    for text in author["affils"]:
+        out.append(rf"\{mode['affil_cmd']}{{{text}}}")
+    out.append("")
+
+
+def emit_spie(mode, buf, author):
+    """Author with affiliation indices followed by any new affiliations."""
+    out = buf["out"]
+    out.append(
+        mode["author_form"](
+            f"[{author['affilAuth']}]", author["initials"], author["surname"]
+        )
+    )
+    out.append("\n".join(author["affilOutput"]))
+    out.append("")
 
-        affilInd = affilset.index(theAffil) + 1
-        if args.noafil:
-            affilAuth = affilAuth
-        else:
-            affilAuth = auth_afil_form.format(affilAuth, affilSep, str(affilInd))
 
-        affilSep = " "
+def emit_buffered(mode, buf, author):
+    """Buffer the author and any new affiliations."""
+    buf["authors"][author["anum"]] = mode["author_form"](
+        author["initials"], author["surname"], author["affilAuth"]
+    )
+    buf["affils"].extend(author["affilOutput"])
+
+
+def post_adass(buf, noafil):
+    """Single \\author command, the affiliations and paper metadata."""
+    authOutput = buf["authors"]
+    out = buf["out"]
+    parts = [r"\author{"]
+    last = len(authOutput) - 1
+    for i, auth in enumerate(authOutput):
+        parts.append(auth)
+        if i == last - 1:
+            parts.append(" and ")
+        elif i < last:
+            parts.append(" ")
+    parts.append("}\n")
+    if not noafil:
+        parts.append("\n".join(buf["affils"]))
+    out.append("".join(parts))
+    out.append("\n".join(buf["paperauthors"]))
+    out.append("% Yes they said to have these index commands commented out.")
+    out.append("\n".join(buf["index"]))
+
+
+def post_arxiv(buf, noafil):
+    """Comma separated authors and the affiliations in parentheses."""
+    authOutput = buf["authors"]
+    parts = [r"Authors:"]
+    last = len(authOutput) - 1
+    for i, auth in enumerate(authOutput):
+        parts.append(auth)
+        if i < last:
+            parts.append(", ")
+    parts.append("\n(")
+    if not noafil:
+        parts.append(", ".join(buf["affils"]))
+    parts.append(")\n")
+    buf["out"].append("".join(parts))
+
+
+# affil_cmd: command for latex affiliation
+# affil_form: format of the affiliation
+# affil_text: the part of the affiliation text to use
+# auth_afil_form: format of author with affiliation
+# author_form: format of the author
+# author_super: author affiliation as super script
+# paperauthor: write \paperauthor and \aindex entries for each author
+# The default is AAS and if no mode is specified you get that
+OUTPUT_MODES = {
+    "aas": dict(
+        affil_cmd="affiliation",
+        affil_form=aas_affil,
+        affil_text=full_affil_text,
+        auth_afil_form=aas_auth_afil,
+        author_form=aas_author,
+        author_super=False,
+        paperauthor=False,
+        emit=emit_aas,
+        post=None,
+    ),
+    "spie": dict(
+        affil_cmd="affil",
+        affil_form=aas_affil,
+        affil_text=full_affil_text,
+        auth_afil_form=aas_auth_afil,
+        author_form=aas_author,
+        author_super=False,
+        paperauthor=False,
+        emit=emit_spie,
+        post=None,
+    ),
+    "adass": dict(
+        affil_cmd="affil",
+        affil_form=r"\{}{{$^{}${}}}".format,
+        affil_text=full_affil_text,
+        auth_afil_form="{}{}$^{}$".format,
+        author_form=r"{}~{}{}".format,  # initial, surname, affil
+        author_super=True,
+        paperauthor=True,
+        emit=emit_buffered,
+        post=post_adass,
+    ),
+    "arxiv": dict(
+        affil_cmd="",
+        affil_form=r"{}({}) {}".format,
+        affil_text=institute_affil_text,
+        auth_afil_form="{}{}({})".format,
+        author_form=r"{} {}{}".format,
+        author_super=False,
+        paperauthor=False,
+        emit=emit_buffered,
+        post=post_arxiv,
+    ),
+}
+
+
+def main():
+    description = __doc__
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=description, formatter_class=formatter)
+
+    parser.add_argument(
+        "-m",
+        "--mode",
+        default="aas",
+        choices=OUTPUT_MODES,
+        help="""Display mode for translated parameters.
+                         'verbose' displays all the information...""",
+    )
+    parser.add_argument(
+        "-n",
+        "--noafil",
+        action="store_true",
+        help="""Do not add affil at all for arxiv.""",
+    )
+    args = parser.parse_args()
+
+    mode = OUTPUT_MODES[args.mode]
+    affil_cmd = mode["affil_cmd"]
+    affil_form = mode["affil_form"]
+    affil_text = mode["affil_text"]
+    auth_afil_form = mode["auth_afil_form"]
+    author_super = mode["author_super"]
+    paperauthor = mode["paperauthor"]
+
+    with open(authorfile, "rb") as fh:
+        authors = tuple(yaml.load(fh, Loader=Loader))
+
+    authordb = load_authordb(dbfile)
+
+    # author db is dict indexed by author id.
+    # Each entry is a dict with keys
+    # name: Surname
+    # initials: A.B.
+    # orcid: ORCID (can be None)
+    # affil: List of affiliation labels
+    # altaffil: List of alternate affiliation text
+    authorinfo = authordb["authors"]
+
+    # dict of all the affiliations, key is a label
+    # used in author list
+    affil = authordb["affiliations"]
+    affilset = dict()  # affiliation label to its 1-based index, in order seen
+
+    # AASTeX6.1 author files are of the form:
+    # \author[ORCID]{Initials~Surname}
+    # \altaffiliation{Hubble Fellow}   * must come straight after author
+    # \affiliation{Affil1}
+    # \affiliation{Affill2}
+    # Do not yet handle \email or \correspondingauthor
+
+    if WRITE_CSV:
+        # Used for arXiv submission
+        names = ["{auth[initials]} {auth[name]}".format(auth=a) for a in authors]
+        print(", ".join(names))
+        sys.exit(0)
+
+    # All output is collected here and written out in one go. The per
+    # author lists are filled in by position.
+    buf = dict(
+        out=list(),
+        authors=[None] * len(authors),
+        affils=list(),
+        paperauthors=[None] * len(authors),
+        index=[None] * len(authors),
+    )
+    out = buf["out"]
 
-    if buffer_affil:
-        orcid = "[{}]".format(affilAuth)
-    else:
-        if "orcid" in auth and auth["orcid"]:
-            orcid = "[{}]".format(auth["orcid"])
-
-    orc = auth.get("orcid", "")
-    if orc is None:
-        orc = ""
-    email = auth.get("email", "")
-    if email is None:
-        email = ""
-    # For spaces in surnames use a ~
-    surname = re.sub(r"\s+", "~", auth["name"])
+    out.append(
+        """%% DO NOT EDIT THIS FILE. IT IS GENERATED FROM db2authors.py"
+%% Regenerate using:"""
+    )
+    out.append(f"%%    python $LSST_TEXMF_DIR/bin/db2authors.py {args} ")
+    out.append("")
 
-    # Preference for A.~B.~Surname rather than A.B.~Surname
-    initials = re.sub(r"\.(\w)", lambda m: ".~" + m.group(1), auth["initials"])
+    missing = [a for a in authors if a not in authorinfo]
+    if missing:
+        raise RuntimeError(
+            f"Author ID{'s' if len(missing) > 1 else ''} "
+            f"{', '.join(map(str, missing))} not defined in author database."
+        )
 
-    # For spaces in initials use a ~
-    initials = re.sub(r"\s+", "~", initials)
+    # First pass: number the affiliations in the order they are first used.
+    # For each author keep their affiliation indices and the labels they
+    # introduce.
+    author_affils = list()
+    new_affils = list()
+    for authorid in authors:
+        auth_affil = authorinfo[authorid]["affil"]
+        new = list()
+        for theAffil in auth_affil:
+            if theAffil not in affilset:
+                affilset[theAffil] = len(affilset) + 1
+                new.append(theAffil)
+        author_affils.append([affilset[a] for a in auth_affil])
+        new_affils.append(new)
+
+    # Second pass: format each author
+    emit = mode["emit"]
+    last_idx = len(authors) - 1
+    for anum, authorid in enumerate(authors):
+        auth = authorinfo[authorid]
 
-    # adass has index and paper authors ..
-    addr = [a.strip() for a in affil[theAffil].split(",")]
-    tute = addr[0]
-    ind = len(addr) - 1
-    if ind > 0:
-        country = addr[ind]
-        ind = ind - 1
-    if ind > 0:
-        sc = addr[ind].split()
-        ind = ind - 1
-        state = sc[0]
-        pcode = ""
-        if len(sc) == 2:
-            pcode = sc[1]
-    city = ""
-    if ind > 0:
-        city = addr[ind]
+        # unforuneately you can not output an affil before an author
+        affilOutput = [
+            affil_form(affil_cmd, affilset[a], affil_text(affil[a]))
+            for a in new_affils[anum]
+        ]
+
+        affilAuth = ""
+        if not args.noafil:
+            affilSep = ""
+            if author_super and anum < last_idx:
+                # ADASS  comma before the affil except the last entry
+                affilSep = ","
+            for affilInd in author_affils[anum]:
+                affilAuth = auth_afil_form(affilAuth, affilSep, str(affilInd))
+                affilSep = " "
+
+        # For spaces in surnames use a ~
+        surname = _WS_RE.sub("~", auth["name"])
+
+        initials = format_initials(auth["initials"])
+
+        # The affiliations have to be retrieved via label
+        affils = [affil[a] for a in auth["affil"]]
+
+        # adass has index and paper authors ..
+        if paperauthor:
+            orc = auth.get("orcid") or ""
+            email = auth.get("email") or ""
+            # The address is that of the primary (first listed) affiliation
+            tute, city, state, pcode, country = parse_address(affils[0])
+
+            buf["paperauthors"][anum] = (
+                rf"\paperauthor{{{initials}~{surname}}}{{{email}}}{{{orc}}}"
+                rf"{{{tute}}}{{}}{{{city}}}{{{state}}}{{{pcode}}}{{{country}}}"
+            )
 
-    pAuthorOutput.append(
-        r"\paperauthor{{{}~{}}}{{{}}}{{{}}}{{{}}}{{}}{{{}}}{{{}}}{{{}}}{{{}}}".format(
-            initials, surname, email, orc, tute, city, state, pcode, country
+            # Split the db entry directly, the separators added by
+            # format_initials() make no difference to the result
+            justInitials = get_initials(auth["initials"])
+            buf["index"][anum] = rf"%\aindex{{{surname},{justInitials}}}"
+
+        emit(
+            mode,
+            buf,
+            dict(
+                anum=anum,
+                auth=auth,
+                initials=initials,
+                surname=surname,
+                affils=affils,
+                affilAuth=affilAuth,
+                affilOutput=affilOutput,
+            ),
         )
-    )
 
-    if args.mode == "arxiv":
-        affilOutput = list()  # reset this
-        affilOutput.append(affil_form.format(affil_cmd, len(affilset), tute))
+    if mode["post"] is not None:
+        mode["post"](buf, args.noafil)
 
-    justInitials = get_initials(initials)
-    indexOutput.append(r"%\aindex{{{},{}}}".format(surname, justInitials))
-
-    if buffer_authors:
-        authOutput.append(author_form.format(initials, surname, affilAuth))
-        allAffil = allAffil + affilOutput
-    else:
-        print(author_form.format(orcid, initials, surname))
-        if buffer_affil:
-            print(*affilOutput, sep="\n")
-        else:
-            if auth.get("altaffil"):
-                for af in auth["altaffil"]:
-                    print(r"\altaffiliation{{{}}}".format(af))
-
-            # The affiliations have to be retrieved via label
-            for aflab in auth["affil"]:
-                print(r"\{}{{{}}}".format(affil_cmd, affil[aflab]))
-        print()
-
-if buffer_authors:
-    if args.mode == "arxiv":
-        print(r"Authors:", end="")
-    else:
-        print(r"\author{", end="")
-    anum = 0
-    numAuths = len(authOutput) - 1
-    for auth in authOutput:
-        print(auth, end="")
-        anum = anum + 1
-        if (anum == numAuths and numAuths > 1) or (
-            args.mode == "arxiv" and anum < numAuths
-        ):
-            print(author_sep, end="")
-        else:
-            if anum < numAuths:
-                print(" ", end="")
-    if args.mode == "arxiv":
-        print("\n(", end="")
+    # Encode once and write the bytes, bypassing the text layer of stdout,
+    # unless stdout has been replaced by something without a buffer.
+    text = "\n".join(out) + "\n"
+    if hasattr(sys.stdout, "buffer"):
+        sys.stdout.flush()
+        sys.stdout.buffer.write(text.encode("utf-8"))
     else:
-        print("}")
-    if not args.noafil:
-        print(*allAffil, sep=affil_out_sep, end="")
-    if args.mode == "arxiv":
-        print(")\n")
-    if args.mode != "arxiv":
-        print("")
-        print(*pAuthorOutput, sep="\n")
-        print("% Yes they said to have these index commands commented out.")
-        print(*indexOutput, sep="\n")
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
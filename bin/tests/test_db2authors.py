@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from db2authors import load_authordb
+
+TESTDB = """affiliations:
+  Rubin: Rubin Observatory Project Office, 950 N. Cherry Ave., Tucson, AZ 85719, USA
+authors:
+  testy:
+    name: McTest
+    initials: Testy
+    affil:
+    - Rubin
+"""
+
+
+class TestAuthorDbCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpdir, "authordb.yaml")
+        self.cachefile = self.dbfile + ".cache.json"
+        self.write_db(TESTDB)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write_db(self, text):
+        with open(self.dbfile, "w") as fh:
+            fh.write(text)
+
+    def testCacheHit(self):
+        db = load_authordb(self.dbfile)
+        self.assertTrue(os.path.exists(self.cachefile))
+        # A cache hit must not parse the YAML again
+        with mock.patch("db2authors.yaml.load") as load:
+            self.assertEqual(load_authordb(self.dbfile), db)
+            load.assert_not_called()
+
+    def testCacheStale(self):
+        load_authordb(self.dbfile)
+        st = os.stat(self.dbfile)
+        self.write_db(TESTDB.replace("McTest", "McTested"))
+        # The size changes, keep the mtime to check it is not the only test
+        os.utime(self.dbfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+        db = load_authordb(self.dbfile)
+        self.assertEqual(db["authors"]["testy"]["name"], "McTested")
+        # The cache was rewritten so the next read agrees
+        with mock.patch("db2authors.yaml.load") as load:
+            self.assertEqual(load_authordb(self.dbfile), db)
+            load.assert_not_called()
+
+    def testCacheUnwritable(self):
+        with mock.patch("db2authors.tempfile.mkstemp", side_effect=PermissionError):
+            db = load_authordb(self.dbfile)
+        self.assertEqual(db["authors"]["testy"]["name"], "McTest")
+        self.assertFalse(os.path.exists(self.cachefile))
+
+    def testNotCacheable(self):
+        # Dates can not be written to JSON, integer keys would come back
+        # as strings. Neither may stop the load or be cached.
+        for extra in ("    joined: 2020-01-01\n", "  42:\n    name: Answer\n"):
+            self.write_db(TESTDB + extra)
+            db = load_authordb(self.dbfile)
+            self.assertIn("testy", db["authors"])
+            self.assertFalse(os.path.exists(self.cachefile))
+        self.assertIn(42, db["authors"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,9 @@ import subprocess
 
 import yaml
 
+# Use the libyaml parser if it is available, it is much faster.
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 def make_all(authordb):
     """Go through all authors and put in one big file so we can test"""
@@ -20,8 +23,8 @@ def make_all(authordb):
 def main():
     dbfile = os.path.normpath(os.path.join(".", "etc", "authordb.yaml"))
 
-    with open(dbfile, "r") as fh:
-        authordb = yaml.safe_load(fh)
+    with open(dbfile, "rb") as fh:
+        authordb = yaml.load(fh, Loader=Loader)
 
     make_all(authordb)
     subprocess.call("bin/db2authors.py", shell=True)